@@ -1,67 +1,230 @@
 #!/usr/bin/env python3
 """
 Second Brain API Backend
-Flask API service that the Swift menubar app will communicate with
+FastAPI service that the Swift menubar app will communicate with
 """
 
-from flask import Flask, request, jsonify
-from flask_cors import CORS
+from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
+from pydantic import BaseModel
+import numpy as np
+import orjson
+import queue
+import uvicorn
 import threading
-from typing import Optional
-from vector_db import VectorDatabase
-from ocr import capture_and_extract
-from langchain_ollama import OllamaLLM
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain.chains import RetrievalQA
-from langchain_community.vectorstores import Qdrant
+import time
+import urllib.request
+from collections import OrderedDict, deque
+from typing import TYPE_CHECKING, Optional
 
-app = Flask(__name__)
-CORS(app)
+# Heavy modules (torch, sentence-transformers, numba kernels, langchain) are
+# imported in initialize_components, so the server starts answering
+# /api/health right away instead of after several seconds of imports
+if TYPE_CHECKING:
+    from vector_db import VectorDatabase
+    from langchain_ollama import OllamaLLM
+
+# No CORS middleware: the only client is the native Swift app, which isn't
+# subject to CORS, and the server binds 127.0.0.1
+app = FastAPI(title="Second Brain API", default_response_class=ORJSONResponse)
 
 # Global state
-vector_db: Optional[VectorDatabase] = None
-llm: Optional[OllamaLLM] = None
-qa_chain: Optional[RetrievalQA] = None
-embeddings: Optional[HuggingFaceEmbeddings] = None
+vector_db: "Optional[VectorDatabase]" = None
+llm: "Optional[OllamaLLM]" = None
 initialization_status = {"ready": False, "message": "Initializing..."}
-chat_history = []
+
+# Bounded chat history, kept as pre-encoded JSON messages so building the
+# /api/history body is a bytes join, cached until the history changes
+CHAT_HISTORY_LIMIT = 400
+chat_history = deque(maxlen=CHAT_HISTORY_LIMIT)
+_history_cached_json: Optional[bytes] = None
+
+# Number of retrieved chunks passed to the LLM, and how many are returned as sources
+RETRIEVAL_K = 3
+SOURCES_K = 2
+
+# Payload fields kept out of source metadata: the chunk text and dedup fingerprints
+INTERNAL_PAYLOAD_KEYS = ('text', 'content_hash', 'simhash')
+
+# The instructions never change, so Ollama can reuse its KV cache for
+# this prefix; only the retrieved context and question vary per request
+PROMPT = (
+    "You are a helpful assistant answering questions from the user's "
+    "personal knowledge base. Use only the provided context to answer. "
+    "If the answer is not in the context, say that you don't know. "
+    "Keep answers concise.\n\n"
+    "Context:\n{context}\n\n"
+    "Question: {q}\n"
+    "Answer:"
+)
+
+# LRU cache of answered queries: query -> {'response', 'sources', 'embedding'}.
+# Exact matches only by default. With SEMANTIC_ANSWER_CACHE, a question whose
+# embedding is close enough to a cached one (cosine similarity) reuses that
+# answer -- off by default, since near-identical questions ("... Monday" vs
+# "... Tuesday") can score above the threshold and get the wrong answer
+ANSWER_CACHE_SIZE = 256
+SEMANTIC_ANSWER_CACHE = False
+SEMANTIC_CACHE_THRESHOLD = 0.95
+ANSWER_CACHE: "OrderedDict[str, dict]" = OrderedDict()
+answer_cache_lock = threading.Lock()
+
+# Bumped on every clear, so an answer generated from context fetched before
+# a clear (e.g. a capture landing while the LLM runs) is never cached after it
+answer_cache_generation = 0
+
+
+def get_cached_answer(user_query, query_embedding=None):
+    """Return a cached answer (exact, then semantic) and mark it as recently used"""
+    with answer_cache_lock:
+        key = user_query
+        if key not in ANSWER_CACHE:
+            if query_embedding is None or not ANSWER_CACHE:
+                return None
+            
+            # Embeddings are normalized, so one matrix-vector product gives
+            # the cosine similarity to every cached question
+            keys = list(ANSWER_CACHE)
+            matrix = np.stack([ANSWER_CACHE[k]['embedding'] for k in keys])
+            scores = matrix @ query_embedding
+            best = int(np.argmax(scores))
+            if scores[best] < SEMANTIC_CACHE_THRESHOLD:
+                return None
+            key = keys[best]
+        
+        ANSWER_CACHE.move_to_end(key)
+        return ANSWER_CACHE[key]
+
+
+async def lookup_answer(user_query):
+    """
+    Check the answer cache, embedding the query only on an exact miss.
+    Returns the cached answer (or None) and the cache generation to hand
+    back to cache_answer.
+    """
+    generation = answer_cache_generation
+    cached = get_cached_answer(user_query)
+    if cached is None and SEMANTIC_ANSWER_CACHE:
+        query_embedding = await vector_db.aembed_query(user_query)
+        cached = get_cached_answer(user_query, query_embedding)
+    return cached, generation
+
+
+def cache_answer(user_query, answer, generation):
+    """
+    Store an answer, evicting the least recently used one when full.
+    Skipped if the cache was cleared since lookup_answer returned generation.
+    """
+    if SEMANTIC_ANSWER_CACHE:
+        # The query embedding is already in VectorDatabase's LRU cache from the search
+        answer['embedding'] = vector_db.embed_query(user_query)
+    with answer_cache_lock:
+        if generation != answer_cache_generation:
+            return
+        ANSWER_CACHE[user_query] = answer
+        ANSWER_CACHE.move_to_end(user_query)
+        if len(ANSWER_CACHE) > ANSWER_CACHE_SIZE:
+            ANSWER_CACHE.popitem(last=False)
+
+
+def clear_answer_cache():
+    """Drop cached answers (call whenever the knowledge base changes)"""
+    global answer_cache_generation
+    with answer_cache_lock:
+        ANSWER_CACHE.clear()
+        answer_cache_generation += 1
+
+
+# Captures are queued and stored in batches by a background worker, so one
+# embedding pass and one upload cover several captures taken in a row
+CAPTURE_BATCH_SIZE = 16
+CAPTURE_FLUSH_INTERVAL = 0.5  # seconds
+capture_queue: "queue.Queue[tuple]" = queue.Queue(maxsize=256)
+
+
+def capture_worker():
+    """Drain the capture queue in batches of up to 16 items or 500ms"""
+    while True:
+        batch = [capture_queue.get()]
+        deadline = time.monotonic() + CAPTURE_FLUSH_INTERVAL
+        
+        while len(batch) < CAPTURE_BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(capture_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        
+        texts = [text for text, _ in batch]
+        metadatas = [metadata for _, metadata in batch]
+        
+        try:
+            vector_db.add_texts(texts, metadatas)
+            clear_answer_cache()
+        except Exception as e:
+            print(f"❌ Failed to store {len(batch)} captures: {e}")
+
+
+# Ollama server and model; the model is pinned resident (keep_alive=-1)
+OLLAMA_URL = "http://localhost:11434"
+LLM_MODEL = "llama3.1:8b"
+OLLAMA_HEARTBEAT_INTERVAL = 240  # seconds
+
+
+def preload_llm():
+    """Load the model into Ollama without generating anything"""
+    body = orjson.dumps({"model": LLM_MODEL, "prompt": "", "keep_alive": -1})
+    request = urllib.request.Request(
+        f"{OLLAMA_URL}/api/generate",
+        data=body,
+        headers={"Content-Type": "application/json"}
+    )
+    with urllib.request.urlopen(request, timeout=300) as response:
+        response.read()
+
+
+def ollama_heartbeat():
+    """Re-pin the model every few minutes so it is never evicted"""
+    while True:
+        time.sleep(OLLAMA_HEARTBEAT_INTERVAL)
+        try:
+            preload_llm()
+        except Exception as e:
+            print(f"⚠️  Ollama heartbeat failed: {e}")
 
 
 def initialize_components():
-    """Initialize vector DB, LLM, and RAG chain"""
-    global vector_db, llm, qa_chain, embeddings, initialization_status
+    """Initialize vector DB and LLM"""
+    global vector_db, llm, initialization_status
     
     try:
         print("🚀 Initializing Second Brain backend...")
         
+        # Importing ocr compiles its Numba kernels; do it before vector_db is
+        # set, since the capture route only runs once vector_db exists
+        import ocr  # noqa: F401
+        from vector_db import VectorDatabase
+        from langchain_ollama import OllamaLLM
+        
         # Initialize Vector DB
         print("📦 Loading Vector Database...")
         vector_db = VectorDatabase(collection_name="book_knowledge")
         
         # Initialize LLM
         print("🤖 Loading LLM (Ollama)...")
-        llm = OllamaLLM(model="llama3.1:8b")
-        
-        # Initialize embeddings
-        print("🧮 Loading Embeddings...")
-        embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
-        
-        # Create LangChain wrapper with retriever
-        print("🔗 Setting up RAG chain...")
-        vector_store = Qdrant(
-            client=vector_db.client,
-            collection_name="book_knowledge",
-            embeddings=embeddings,
-            content_payload_key="text"
-        )
-        retriever = vector_store.as_retriever(search_kwargs={"k": 3})
-        
-        # Create QA chain
-        qa_chain = RetrievalQA.from_chain_type(
-            llm=llm,
-            retriever=retriever,
-            return_source_documents=True
-        )
+        # keep_alive=-1 pins the weights and prompt KV cache in memory
+        llm = OllamaLLM(model=LLM_MODEL, keep_alive=-1, num_ctx=4096)
+        
+        # Load the model now so the first real query doesn't pay for it.
+        # Ollama may not be up yet; that's not fatal, the heartbeat keeps
+        # re-pinning the model (also after Ollama restarts or swaps models)
+        try:
+            preload_llm()
+        except Exception as e:
+            print(f"⚠️  Could not preload Ollama model (will retry): {e}")
+        threading.Thread(target=ollama_heartbeat, daemon=True).start()
         
         initialization_status = {"ready": True, "message": "All systems ready! 🎉"}
         print("✅ Backend initialization complete!")
@@ -71,151 +234,248 @@ def initialize_components():
         print(f"❌ Initialization error: {e}")
 
 
-# Initialize in background
-threading.Thread(target=initialize_components, daemon=True).start()
+@app.on_event("startup")
+def start_background_threads():
+    """Initialize in background so the server accepts requests right away"""
+    threading.Thread(target=initialize_components, daemon=True).start()
+    threading.Thread(target=capture_worker, daemon=True).start()
+
 
+class QueryRequest(BaseModel):
+    query: str = ""
 
-@app.route('/api/health', methods=['GET'])
-def health_check():
+
+async def retrieve_context(user_query):
+    """Search Qdrant and build the LLM prompt and source list for a query"""
+    
+    # Retrieve context straight from Qdrant (reuses VectorDatabase's model)
+    hits = await vector_db.asearch(user_query, limit=RETRIEVAL_K)
+    context = "\n\n".join(hit.payload['text'] for hit in hits)
+    prompt = PROMPT.format(context=context, q=user_query)
+    
+    # Include source documents
+    sources = []
+    for hit in hits[:SOURCES_K]:
+        sources.append({
+            'content': hit.payload['text'][:150],
+            'metadata': {k: v for k, v in hit.payload.items() if k not in INTERNAL_PAYLOAD_KEYS}
+        })
+    
+    return prompt, sources
+
+
+def not_ready_response():
+    return ORJSONResponse({
+        'error': 'System not ready yet',
+        'message': initialization_status['message']
+    }, status_code=503)
+
+
+def sse_event(data):
+    return f"data: {orjson.dumps(data).decode()}\n\n"
+
+
+def add_to_history(user_query, answer):
+    """Record a question/answer pair and invalidate the cached JSON"""
+    global _history_cached_json
+    for message in ({'role': 'user', 'content': user_query},
+                    {'role': 'assistant', 'content': answer}):
+        chat_history.append(orjson.dumps(message))
+    _history_cached_json = None
+
+
+@app.get('/api/health')
+async def health_check():
     """Health check endpoint"""
-    return jsonify({
+    return {
         'status': 'ok',
         'initialized': initialization_status['ready'],
         'message': initialization_status['message']
-    })
+    }
 
 
-@app.route('/api/query', methods=['POST'])
-def query():
-    """Handle RAG queries"""
+@app.post('/api/query')
+async def query(body: QueryRequest):
+    """Handle RAG queries (async, so waits on Qdrant and Ollama overlap)"""
     if not initialization_status['ready']:
-        return jsonify({
-            'error': 'System not ready yet',
-            'message': initialization_status['message']
-        }), 503
+        return not_ready_response()
     
-    data = request.json
-    user_query = data.get('query', '')
+    user_query = body.query
     
     if not user_query:
-        return jsonify({'error': 'No query provided'}), 400
+        return ORJSONResponse({'error': 'No query provided'}, status_code=400)
     
     try:
-        # Use the QA chain to get an answer
-        response = qa_chain.invoke({"query": user_query})
-        
-        # Format the response
-        answer = response['result']
-        
-        # Include source documents
-        sources = []
-        if response.get('source_documents'):
-            for doc in response['source_documents'][:2]:
-                sources.append({
-                    'content': doc.page_content[:150],
-                    'metadata': doc.metadata
-                })
+        cached, generation = await lookup_answer(user_query)
+        if cached is not None:
+            answer = cached['response']
+            sources = cached['sources']
+        else:
+            prompt, sources = await retrieve_context(user_query)
+            
+            # Single LLM call with the retrieved context
+            answer = await llm.ainvoke(prompt)
+            
+            cache_answer(user_query, {'response': answer, 'sources': sources}, generation)
         
         # Add to chat history
-        chat_history.append({'role': 'user', 'content': user_query})
-        chat_history.append({'role': 'assistant', 'content': answer})
+        add_to_history(user_query, answer)
         
-        return jsonify({
+        return {
             'response': answer,
             'sources': sources,
             'success': True
-        })
+        }
         
     except Exception as e:
-        return jsonify({
+        return ORJSONResponse({
             'error': str(e),
             'success': False
-        }), 500
+        }, status_code=500)
+
 
+@app.post('/api/query/stream')
+async def query_stream(body: QueryRequest):
+    """
+    Handle RAG queries as Server-Sent Events: one {'token': ...} event per
+    generated chunk, then a final {'done': True, 'sources': [...]} event
+    """
+    if not initialization_status['ready']:
+        return not_ready_response()
+    
+    user_query = body.query
+    
+    if not user_query:
+        return ORJSONResponse({'error': 'No query provided'}, status_code=400)
+    
+    async def event_stream():
+        try:
+            cached, generation = await lookup_answer(user_query)
+            if cached is not None:
+                answer = cached['response']
+                sources = cached['sources']
+                yield sse_event({'token': answer})
+            else:
+                prompt, sources = await retrieve_context(user_query)
+                
+                chunks = []
+                async for chunk in llm.astream(prompt):
+                    chunks.append(chunk)
+                    yield sse_event({'token': chunk})
+                
+                answer = "".join(chunks)
+                cache_answer(user_query, {'response': answer, 'sources': sources}, generation)
+            
+            # Add to chat history
+            add_to_history(user_query, answer)
+            
+            yield sse_event({'done': True, 'sources': sources, 'success': True})
+            
+        except Exception as e:
+            yield sse_event({'error': str(e), 'success': False})
+    
+    return StreamingResponse(event_stream(), media_type='text/event-stream')
 
-@app.route('/api/capture/full', methods=['POST'])
+
+@app.post('/api/cache/clear')
+async def clear_cache():
+    """Drop all cached answers"""
+    clear_answer_cache()
+    return {'success': True}
+
+
+# Blocking handlers (OCR, sync Qdrant calls) are plain defs: FastAPI runs
+# them in its threadpool so they don't stall the event loop
+
+@app.post('/api/capture/full')
 def capture_full_screen():
     """Capture full screen and extract text"""
     if not vector_db:
-        return jsonify({'error': 'Vector database not ready'}), 503
+        return ORJSONResponse({'error': 'Vector database not ready'}, status_code=503)
     
     try:
         # Capture and extract
+        from ocr import capture_and_extract  # already imported during initialization
         text = capture_and_extract(region=None)
         
         if not text or len(text.strip()) < 10:
-            return jsonify({
+            return {
                 'success': False,
                 'message': 'No meaningful text found'
-            })
+            }
         
-        # Store in vector DB
-        vector_db.add_text(text, metadata={"source": "screenshot_full"})
+        # Queue for storage; the worker embeds and uploads in batches
+        capture_queue.put((text, {"source": "screenshot_full"}))
         
-        return jsonify({
+        return {
             'success': True,
             'message': f'Captured {len(text)} characters',
             'text_length': len(text)
-        })
+        }
         
     except Exception as e:
-        return jsonify({
+        return ORJSONResponse({
             'success': False,
             'error': str(e)
-        }), 500
+        }, status_code=500)
 
 
-@app.route('/api/stats', methods=['GET'])
+@app.get('/api/stats')
 def get_stats():
     """Get database statistics"""
     if not vector_db:
-        return jsonify({'error': 'Vector database not ready'}), 503
+        return ORJSONResponse({'error': 'Vector database not ready'}, status_code=503)
     
     try:
         stats = vector_db.get_stats()
-        return jsonify({
+        return {
             'success': True,
             'stats': stats
-        })
+        }
     except Exception as e:
-        return jsonify({
+        return ORJSONResponse({
             'success': False,
             'error': str(e)
-        }), 500
+        }, status_code=500)
 
 
-@app.route('/api/history', methods=['GET'])
-def get_history():
-    """Get chat history"""
-    return jsonify({'history': chat_history})
+@app.get('/api/history')
+async def get_history():
+    """Get chat history (serialized once per change)"""
+    global _history_cached_json
+    if _history_cached_json is None:
+        _history_cached_json = b'{"history":[' + b','.join(chat_history) + b']}'
+    return Response(_history_cached_json, media_type='application/json')
 
 
-@app.route('/api/history', methods=['DELETE'])
-def clear_history():
+@app.delete('/api/history')
+async def clear_history():
     """Clear chat history"""
-    global chat_history
-    chat_history = []
-    return jsonify({'success': True})
+    global _history_cached_json
+    chat_history.clear()
+    _history_cached_json = None
+    return {'success': True}
 
 
-@app.route('/api/database', methods=['DELETE'])
+@app.delete('/api/database')
 def clear_database():
     """Clear the entire database"""
     if not vector_db:
-        return jsonify({'error': 'Vector database not ready'}), 503
+        return ORJSONResponse({'error': 'Vector database not ready'}, status_code=503)
     
     try:
         vector_db.delete_collection()
         vector_db._create_collection_if_not_exists()
-        return jsonify({
+        clear_answer_cache()
+        return {
             'success': True,
             'message': 'Database cleared'
-        })
+        }
     except Exception as e:
-        return jsonify({
+        return ORJSONResponse({
             'success': False,
             'error': str(e)
-        }), 500
+        }, status_code=500)
 
 
 if __name__ == '__main__':
@@ -226,5 +486,16 @@ if __name__ == '__main__':
     print("Press Ctrl+C to stop")
     print("=" * 50)
     
-    app.run(host='127.0.0.1', port=5555, debug=False)
+    # No per-request access log: it would write a stdout line on every call.
+    # Idle connections stay open for 75s (uvicorn default: 5s) so the Swift
+    # app's URLSession reuses one connection across chat turns
+    uvicorn.run(
+        app,
+        host='127.0.0.1',
+        port=5555,
+        workers=1,
+        loop='uvloop',
+        access_log=False,
+        timeout_keep_alive=75
+    )
 
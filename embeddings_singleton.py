@@ -0,0 +1,53 @@
+# embeddings_singleton.py
+"""Process-wide SentenceTransformer shared by VectorDatabase and LangChain"""
+
+import threading
+import torch
+from langchain_core.embeddings import Embeddings
+from sentence_transformers import SentenceTransformer
+
+MODEL_NAME = 'all-MiniLM-L6-v2'
+
+MODEL = None
+_lock = threading.Lock()
+
+
+def pick_device():
+    """Pick the fastest available torch device for the embedding model"""
+    if torch.cuda.is_available():
+        return "cuda"
+    if torch.backends.mps.is_available():
+        return "mps"
+    return "cpu"
+
+
+def get() -> SentenceTransformer:
+    """Load the embedding model on first use and return the shared instance"""
+    global MODEL
+    
+    if MODEL is None:
+        with _lock:
+            if MODEL is None:
+                device = pick_device()
+                model = SentenceTransformer(MODEL_NAME, device=device)
+                
+                # Half precision halves memory traffic on GPU; CPU stays in FP32
+                if device in ("cuda", "mps"):
+                    model.half()
+                
+                # Pre-warm so the first real request skips CUDA/MKL lazy init
+                model.encode("warmup")
+                
+                MODEL = model
+    
+    return MODEL
+
+
+class STWrap(Embeddings):
+    """LangChain embeddings backed by the shared model (normalized vectors)"""
+    
+    def embed_documents(self, texts):
+        return get().encode(texts, normalize_embeddings=True, show_progress_bar=False).tolist()
+    
+    def embed_query(self, text):
+        return get().encode(text, normalize_embeddings=True).tolist()
@@ -2,7 +2,7 @@
 from vector_db import VectorDatabase
 from ocr import capture_and_extract
 from langchain_ollama import OllamaLLM
-from langchain_community.embeddings import HuggingFaceEmbeddings
+from embeddings_singleton import STWrap
 from langchain.chains import RetrievalQA
 from langchain_community.vectorstores import Qdrant  # Optional if using LangChain wrapper
 
@@ -11,7 +11,7 @@ db = VectorDatabase(collection_name="book_knowledge")
 
 # 2️⃣ Initialize LLM and embeddings (use same model as VectorDatabase)
 llm = OllamaLLM(model="llama3.1:8b")
-embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
+embeddings = STWrap()  # shares VectorDatabase's model instead of loading a second copy
 
 # 3️⃣ Capture text (replace region if needed)
 print("📸 Capturing screenshot and extracting text...")
@@ -1,10 +1,113 @@
 # ocr.py
+import threading
+import numba
+import numpy as np
 import pytesseract
 from PIL import Image
 import pyautogui
 
 # Optional: set tesseract path on macOS
 pytesseract.pytesseract.tesseract_cmd = "/opt/homebrew/bin/tesseract"
+TESSDATA_PATH = "/opt/homebrew/share/tessdata"
+
+# Images from preprocess_image are already binarized with dark text on white,
+# so Tesseract's inverted-text pass can be skipped for them (only them: raw
+# dark-mode screenshots still need it)
+TESSERACT_CONFIG = "-c tessedit_do_invert=0"
+
+# Prefer the in-process tesserocr binding: it keeps one TessBaseAPI resident
+# instead of spawning a tesseract process (and writing a temp PNG) per call
+try:
+    from tesserocr import PyTessBaseAPI, PSM
+    
+    _API = PyTessBaseAPI(path=TESSDATA_PATH, psm=PSM.AUTO)
+    _LOCK = threading.Lock()
+except (ImportError, RuntimeError):
+    _API = None
+
+
+@numba.njit(parallel=True, fastmath=True, cache=True)
+def rgb_to_luma(arr):
+    """Convert an (H, W, 3|4) uint8 image to (H, W) uint8 luma (BT.601)"""
+    height, width = arr.shape[0], arr.shape[1]
+    luma = np.empty((height, width), dtype=np.uint8)
+    for y in numba.prange(height):
+        for x in range(width):
+            luma[y, x] = np.uint8(
+                (299 * np.uint32(arr[y, x, 0])
+                 + 587 * np.uint32(arr[y, x, 1])
+                 + 114 * np.uint32(arr[y, x, 2])) // 1000
+            )
+    return luma
+
+
+@numba.njit(parallel=True, fastmath=True, cache=True)
+def otsu_threshold(luma):
+    """Binarize a luma image with Otsu's threshold, as dark text on white"""
+    height, width = luma.shape
+    
+    hist = np.zeros(256, dtype=np.int64)
+    for y in range(height):
+        for x in range(width):
+            hist[luma[y, x]] += 1
+    
+    # Pick the threshold that maximizes between-class variance
+    total = height * width
+    sum_all = 0.0
+    for i in range(256):
+        sum_all += i * hist[i]
+    
+    sum_bg = 0.0
+    weight_bg = 0
+    best_var = -1.0
+    threshold = 0
+    for t in range(256):
+        weight_bg += hist[t]
+        if weight_bg == 0:
+            continue
+        weight_fg = total - weight_bg
+        if weight_fg == 0:
+            break
+        sum_bg += t * hist[t]
+        mean_bg = sum_bg / weight_bg
+        mean_fg = (sum_all - sum_bg) / weight_fg
+        between_var = weight_bg * weight_fg * (mean_bg - mean_fg) ** 2
+        if between_var > best_var:
+            best_var = between_var
+            threshold = t
+    
+    # Dark-mode screens have a mostly dark background: flip so text is dark
+    dark_pixels = 0
+    for i in range(threshold + 1):
+        dark_pixels += hist[i]
+    invert = dark_pixels * 2 > total
+    
+    bw = np.empty((height, width), dtype=np.uint8)
+    for y in numba.prange(height):
+        for x in range(width):
+            is_light = luma[y, x] > threshold
+            bw[y, x] = 255 if is_light != invert else 0
+    return bw
+
+
+# Compile once at import so the first capture doesn't pay for the JIT.
+# np.asarray(pil_image) is read-only, which Numba types separately, so warm
+# the exact specializations preprocess_image uses: read-only RGB(A) input,
+# writable luma (color path) and read-only luma (grayscale path)
+_warmup = np.zeros((16, 16, 3), dtype=np.uint8)
+_warmup.setflags(write=False)
+_warmup_luma = rgb_to_luma(_warmup)
+otsu_threshold(_warmup_luma)
+_warmup_luma.setflags(write=False)
+otsu_threshold(_warmup_luma)
+
+
+def preprocess_image(image):
+    """Grayscale + Otsu-binarize a PIL image before OCR"""
+    arr = np.asarray(image)
+    luma = arr if arr.ndim == 2 else rgb_to_luma(arr)
+    bw = otsu_threshold(np.ascontiguousarray(luma, dtype=np.uint8))
+    return Image.fromarray(bw)
 
 def capture_screenshot(region=None):
     """
@@ -14,13 +117,24 @@ def capture_screenshot(region=None):
     screenshot = pyautogui.screenshot(region=region)
     return screenshot
 
-def extract_text_from_image(image):
-    """Convert PIL image to text using OCR"""
-    text = pytesseract.image_to_string(image)
+def extract_text_from_image(image, preprocessed=False):
+    """
+    Convert PIL image to text using OCR.
+    preprocessed: image came from preprocess_image, so skip the inverted-text pass
+    """
+    if _API is not None:
+        with _LOCK:
+            _API.SetVariable("tessedit_do_invert", "0" if preprocessed else "1")
+            _API.SetImage(image)
+            return _API.GetUTF8Text()
+    
+    config = TESSERACT_CONFIG if preprocessed else ""
+    text = pytesseract.image_to_string(image, config=config)
     return text
 
 def capture_and_extract(region=None):
     """Capture screenshot and extract text in one step"""
     image = capture_screenshot(region)
-    text = extract_text_from_image(image)
+    image = preprocess_image(image)
+    text = extract_text_from_image(image, preprocessed=True)
     return text
@@ -19,7 +19,7 @@ echo "📦 Activating virtual environment..."
 source venv/bin/activate
 
 # Check if dependencies are installed
-if ! python -c "import flask" 2>/dev/null; then
+if ! python -c "import fastapi" 2>/dev/null; then
     echo "📥 Installing dependencies..."
     pip install -r requirements.txt
 fi
@@ -28,7 +28,12 @@ fi
 if ! docker ps | grep -q "qdrant"; then
     echo "🐳 Starting Qdrant database..."
     docker-compose up -d
-    sleep 2
+    
+    # Wait until Qdrant is ready instead of sleeping a fixed time (max ~10s)
+    for _ in $(seq 1 100); do
+        curl -sf http://localhost:6333/readyz > /dev/null && break
+        sleep 0.1
+    done
 fi
 
 # Start the Python API backend
@@ -1,126 +1,398 @@
-from qdrant_client import QdrantClient
-from qdrant_client.models import Distance, VectorParams, PointStruct
-from sentence_transformers import SentenceTransformer
+from qdrant_client import QdrantClient, AsyncQdrantClient
+from qdrant_client.models import (
+    Batch,
+    Distance,
+    HnswConfigDiff,
+    OptimizersConfigDiff,
+    ScalarQuantization,
+    ScalarQuantizationConfig,
+    ScalarType,
+    VectorParams,
+)
 from datetime import datetime
+import asyncio
+import functools
+import numpy as np
+import os
+import threading
 import uuid
+import xxhash
+import embeddings_singleton
+
+# Micro-batch size for encoding many texts at once (OCR chunks, bulk imports)
+ENCODE_BATCH_SIZE = 64
+
+# Points per upsert request and number of requests in flight during ingestion
+UPSERT_CHUNK_SIZE = 32
+UPSERT_CONCURRENCY = 2
+
+# Number of distinct query embeddings kept in memory
+QUERY_CACHE_SIZE = 1024
+
+# Captures whose SimHashes differ in at most this many bits count as duplicates
+NEAR_DUPLICATE_MAX_BITS = 3
+SHINGLE_SIZE = 3
+
+# Chunks of up to 200 words overlapping by 40. MiniLM truncates at 256
+# WordPieces, and OCR text (numbers, punctuation, identifiers) can run well
+# past one WordPiece per word, so chunks are also capped by token count
+CHUNK_SIZE = 200
+CHUNK_OVERLAP = 40
+
+
+def _content_hash(text):
+    """Exact-duplicate fingerprint of normalized text"""
+    return xxhash.xxh64(text.strip().lower().encode()).hexdigest()
+
+
+def _simhash(text):
+    """64-bit SimHash over word shingles, for near-duplicate detection"""
+    words = text.lower().split()
+    shingles = [
+        " ".join(words[i:i + SHINGLE_SIZE])
+        for i in range(max(len(words) - SHINGLE_SIZE + 1, 1))
+    ]
+    
+    # One bit row per shingle hash; each output bit is the majority vote
+    hashes = np.array([xxhash.xxh64(s.encode()).intdigest() for s in shingles], dtype=np.uint64)
+    bits = np.unpackbits(hashes.view(np.uint8)).reshape(len(hashes), 64)
+    votes = bits.sum(axis=0) * 2 > len(hashes)
+    
+    return int.from_bytes(np.packbits(votes).tobytes(), "big")
+
+
+def _chunk(text, count_tokens=None, max_tokens=None, size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
+    """
+    Split text into overlapping chunks of at most `size` words.
+    With count_tokens (words -> tokens per word), a chunk also ends before it
+    would exceed max_tokens; a single oversized word still gets its own chunk.
+    """
+    words = text.split()
+    if not words:
+        return []
+    
+    counts = count_tokens(words) if count_tokens is not None else [1] * len(words)
+    if max_tokens is None:
+        max_tokens = size
+    
+    # Prefix sums: words[start:end] holds cum[end] - cum[start] tokens
+    cum = np.concatenate(([0], np.cumsum(counts)))
+    
+    chunks = []
+    start = 0
+    while True:
+        end = int(np.searchsorted(cum, cum[start] + max_tokens, side="right")) - 1
+        end = max(start + 1, min(end, start + size, len(words)))
+        chunks.append(" ".join(words[start:end]))
+        if end >= len(words):
+            break
+        start = max(end - overlap, start + 1)
+    
+    return chunks
+
 
 class VectorDatabase:
     """Manages connection to Qdrant vector database"""
     
-    def __init__(self, host="localhost", port=6333, collection_name="book_knowledge"):
+    def __init__(self, host="localhost", port=6333, collection_name="book_knowledge", grpc_port=6334):
         print("🔌 Connecting to Qdrant...")
         
-        # Connect to Qdrant
-        self.client = QdrantClient(host=host, port=port)
+        # Connect to Qdrant over gRPC. Async clients are bound to the event
+        # loop they first run on: multi-request ingests create one per run, while
+        # asearch lazily creates one on the serving loop
+        self._aclient = None
+        self._client_kwargs = {
+            "host": host,
+            "port": port,
+            "grpc_port": grpc_port,
+            "prefer_grpc": True
+        }
+        self.client = QdrantClient(**self._client_kwargs)
         self.collection_name = collection_name
         
-        # Initialize embedding model
+        # Initialize embedding model (shared with any LangChain wrappers)
         print("📦 Loading embedding model...")
-        self.embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
+        self.embedding_model = embeddings_singleton.get()
+        self.device = self.embedding_model.device
+        
+        # Per-instance LRU cache so repeated questions skip the forward pass
+        self._embed_query = functools.lru_cache(maxsize=QUERY_CACHE_SIZE)(self._encode_query)
         
         # Get embedding dimension
         self.embedding_dim = self.embedding_model.get_sentence_embedding_dimension()
         
+        # Chunk token budget, leaving room for [CLS] and [SEP]
+        self._max_chunk_tokens = self.embedding_model.max_seq_length - 2
+        
         # Create collection if it doesn't exist
         self._create_collection_if_not_exists()
         
+        # Fingerprints of stored captures -> point id, for dedup in add_text.
+        # SimHashes live in one uint64 array (ids alongside) so the
+        # near-duplicate check is a single vectorized pass. The lock guards
+        # all three, since captures and deletes run on different threads
+        self._fingerprint_lock = threading.Lock()
+        self._seen_hashes = {}
+        self._seen_simhashes = np.empty(0, dtype=np.uint64)
+        self._seen_simhash_ids = []
+        self._load_fingerprints()
+        
         print(f"✅ Connected to Qdrant!")
         print(f"📊 Collection: {collection_name}")
         print(f"📏 Embedding dimension: {self.embedding_dim}")
+        print(f"🖥️  Embedding device: {self.device}")
     
     def _create_collection_if_not_exists(self):
         """Create collection if it doesn't exist"""
         
-        collections = self.client.get_collections().collections
-        collection_names = [col.name for col in collections]
-        
-        if self.collection_name not in collection_names:
+        # Single lookup instead of listing every collection
+        if not self.client.collection_exists(self.collection_name):
             print(f"📁 Creating new collection: {self.collection_name}")
             self.client.create_collection(
                 collection_name=self.collection_name,
+                # Embeddings are L2-normalized client-side, so a plain dot
+                # product gives the cosine similarity
                 vectors_config=VectorParams(
                     size=self.embedding_dim,
-                    distance=Distance.COSINE
-                )
+                    distance=Distance.DOT
+                ),
+                # int8 scalar quantization keeps the index 4x smaller in RAM
+                quantization_config=ScalarQuantization(
+                    scalar=ScalarQuantizationConfig(
+                        type=ScalarType.INT8,
+                        quantile=0.99,
+                        always_ram=True
+                    )
+                ),
+                hnsw_config=HnswConfigDiff(m=16, ef_construct=100, on_disk=False),
+                # memmap_threshold is in KB per segment, not vectors: 20,000 KB
+                # is roughly 13k 384-dim float32 vectors before going on disk
+                optimizers_config=OptimizersConfigDiff(memmap_threshold=20000)
             )
         else:
             print(f"📁 Collection already exists: {self.collection_name}")
     
-    def add_text(self, text, metadata=None):
-        """Add a single text to the database"""
+    def _load_fingerprints(self):
+        """Warm the dedup fingerprints from payloads already in Qdrant"""
         
-        # Generate embedding
-        embedding = self.embedding_model.encode(text).tolist()
+        offset = None
+        while True:
+            records, offset = self.client.scroll(
+                collection_name=self.collection_name,
+                with_payload=["content_hash", "simhash"],
+                with_vectors=False,
+                limit=1000,
+                offset=offset
+            )
+            
+            simhashes = []
+            with self._fingerprint_lock:
+                for record in records:
+                    payload = record.payload or {}
+                    if 'content_hash' in payload:
+                        self._seen_hashes.setdefault(payload['content_hash'], record.id)
+                    if 'simhash' in payload:
+                        simhashes.append(int(payload['simhash'], 16))
+                        self._seen_simhash_ids.append(record.id)
+                self._seen_simhashes = np.append(
+                    self._seen_simhashes, np.array(simhashes, dtype=np.uint64)
+                )
+            
+            if offset is None:
+                break
+    
+    # The fingerprint helpers below expect self._fingerprint_lock to be held
+    
+    def _find_duplicate(self, content_hash, simhash):
+        """Return the point id of an identical or near-identical capture"""
         
-        # Create point
-        point_id = str(uuid.uuid4())
+        if content_hash in self._seen_hashes:
+            return self._seen_hashes[content_hash]
         
-        # Add timestamp if not in metadata
-        if metadata is None:
-            metadata = {}
+        if len(self._seen_simhashes) == 0:
+            return None
         
-        if 'timestamp' not in metadata:
-            metadata['timestamp'] = datetime.now().isoformat()
+        # Hamming distance to every stored SimHash at once: XOR, then popcount
+        diff = self._seen_simhashes ^ np.uint64(simhash)
+        distances = np.unpackbits(diff.view(np.uint8)).reshape(len(diff), 64).sum(axis=1)
         
-        metadata['text'] = text  # Store original text in metadata
+        best = int(np.argmin(distances))
+        if distances[best] <= NEAR_DUPLICATE_MAX_BITS:
+            return self._seen_simhash_ids[best]
         
-        # Upload to Qdrant
-        self.client.upsert(
-            collection_name=self.collection_name,
-            points=[
-                PointStruct(
-                    id=point_id,
-                    vector=embedding,
-                    payload=metadata
-                )
-            ]
-        )
+        return None
+    
+    def _remember(self, content_hash, simhash, point_id):
+        self._seen_hashes[content_hash] = point_id
+        self._seen_simhashes = np.append(self._seen_simhashes, np.uint64(simhash))
+        self._seen_simhash_ids.append(point_id)
+    
+    def _forget(self, content_hash, point_id):
+        if self._seen_hashes.get(content_hash) == point_id:
+            del self._seen_hashes[content_hash]
+        keep = [i for i, seen_id in enumerate(self._seen_simhash_ids) if seen_id != point_id]
+        self._seen_simhashes = self._seen_simhashes[keep]
+        self._seen_simhash_ids = [self._seen_simhash_ids[i] for i in keep]
+    
+    def _count_tokens(self, words):
+        """Number of WordPieces the embedding model sees for each word"""
+        encoded = self.embedding_model.tokenizer(words, add_special_tokens=False)
+        return [len(ids) for ids in encoded['input_ids']]
+    
+    def add_text(self, text, metadata=None):
+        """Add a single text to the database as overlapping chunks"""
+        return self.add_texts([text], [metadata])
+    
+    def add_texts(self, texts, metadatas=None):
+        """
+        Split long texts (e.g. OCR captures) into overlapping chunks and add
+        them all in one batch. Chunks already stored are skipped.
+        Returns the point ids of every chunk.
+        """
         
-        return point_id
+        if metadatas is None:
+            metadatas = [None] * len(texts)
+        
+        chunks = []
+        chunk_metadatas = []
+        for text, metadata in zip(texts, metadatas):
+            metadata = dict(metadata or {})
+            metadata.setdefault('timestamp', datetime.now().isoformat())
+            
+            for i, chunk in enumerate(_chunk(text, self._count_tokens, self._max_chunk_tokens)):
+                chunks.append(chunk)
+                chunk_metadatas.append({**metadata, 'chunk_idx': i})
+        
+        return self.add_texts_batch(chunks, chunk_metadatas, skip_duplicates=True)
     
-    def add_texts_batch(self, texts, metadatas=None):
-        """Add multiple texts in batch"""
+    def add_texts_batch(self, texts, metadatas=None, skip_duplicates=False, wait=True):
+        """
+        Add multiple texts in batch.
+        With skip_duplicates, texts matching a stored (or earlier) text are not
+        re-added and their existing point id is returned in their place.
+        By default this returns once the points are searchable; pass
+        wait=False for bulk imports that nobody queries right away.
+        """
         
         if metadatas is None:
             metadatas = [{}] * len(texts)
         
-        print(f"📤 Adding {len(texts)} texts to database...")
+        # One entropy read and one timestamp for the whole batch
+        random_bytes = os.urandom(16 * len(texts))
+        now_iso = datetime.now().isoformat()
         
-        # Generate embeddings for all texts
-        embeddings = self.embedding_model.encode(texts).tolist()
+        # Fingerprint everything, then check and register new texts under the
+        # lock so duplicates within the same batch (or a concurrent one) are
+        # caught too
+        fingerprints = [(_content_hash(text), _simhash(text)) for text in texts]
         
-        # Create points
-        points = []
-        for text, embedding, metadata in zip(texts, embeddings, metadatas):
-            point_id = str(uuid.uuid4())
-            
-            # Add timestamp and text
-            metadata['timestamp'] = metadata.get('timestamp', datetime.now().isoformat())
-            metadata['text'] = text
-            
-            points.append(
-                PointStruct(
-                    id=point_id,
-                    vector=embedding,
-                    payload=metadata
-                )
-            )
+        point_ids = []
+        new_ids = []
+        new_texts = []
+        new_payloads = []
+        new_hashes = []
+        with self._fingerprint_lock:
+            for i, (text, metadata) in enumerate(zip(texts, metadatas)):
+                content_hash, simhash = fingerprints[i]
+                
+                duplicate_id = self._find_duplicate(content_hash, simhash) if skip_duplicates else None
+                if duplicate_id is not None:
+                    point_ids.append(duplicate_id)
+                    continue
+                
+                point_id = str(uuid.UUID(bytes=random_bytes[16 * i:16 * (i + 1)], version=4))
+                self._remember(content_hash, simhash, point_id)
+                point_ids.append(point_id)
+                
+                new_ids.append(point_id)
+                new_texts.append(text)
+                new_hashes.append(content_hash)
+                new_payloads.append({
+                    **metadata,
+                    'timestamp': metadata.get('timestamp', now_iso),
+                    'text': text,
+                    # Fingerprints as hex strings (Qdrant integers are signed 64-bit)
+                    'content_hash': content_hash,
+                    'simhash': format(simhash, '016x')
+                })
         
-        # Upload to Qdrant
-        self.client.upsert(
-            collection_name=self.collection_name,
-            points=points
+        if not new_ids:
+            return point_ids
+        
+        print(f"📤 Adding {len(new_ids)} texts to database...")
+        
+        # Generate embeddings for all texts in large micro-batches
+        embeddings = self.embedding_model.encode(
+            new_texts,
+            batch_size=ENCODE_BATCH_SIZE,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False
         )
         
-        print(f"✅ Added {len(texts)} texts successfully!")
+        # Batch only validates plain float lists, so convert the whole
+        # ndarray in one C-level call rather than row by row
+        vectors = embeddings.tolist()
+        
+        # A typical capture fits in one request: send it on the persistent
+        # sync channel. Larger ingests go up as columnar batches, several in
+        # flight on a per-run async client
+        try:
+            if len(new_ids) <= UPSERT_CHUNK_SIZE:
+                self.client.upsert(
+                    collection_name=self.collection_name,
+                    points=Batch(ids=new_ids, vectors=vectors, payloads=new_payloads),
+                    wait=wait
+                )
+            else:
+                asyncio.run(self._aupsert_chunks(new_ids, vectors, new_payloads, wait))
+        except Exception:
+            with self._fingerprint_lock:
+                for content_hash, point_id in zip(new_hashes, new_ids):
+                    self._forget(content_hash, point_id)
+            raise
+        
+        print(f"✅ Added {len(new_ids)} texts successfully!")
         
-        return [p.id for p in points]
+        return point_ids
+    
+    async def _aupsert_chunks(self, ids, vectors, payloads, wait, chunk=UPSERT_CHUNK_SIZE, concurrency=UPSERT_CONCURRENCY):
+        """Upsert columnar batches of points, keeping a few requests in flight"""
+        
+        aclient = AsyncQdrantClient(**self._client_kwargs)
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        async def upsert_chunk(start):
+            async with semaphore:
+                await aclient.upsert(
+                    collection_name=self.collection_name,
+                    points=Batch(
+                        ids=ids[start:start + chunk],
+                        vectors=vectors[start:start + chunk],
+                        payloads=payloads[start:start + chunk]
+                    ),
+                    wait=wait
+                )
+        
+        try:
+            await asyncio.gather(*(
+                upsert_chunk(start)
+                for start in range(0, len(ids), chunk)
+            ))
+        finally:
+            await aclient.close()
+    
+    def _encode_query(self, text):
+        """Embed a query string as a read-only ndarray (safe to share from the cache)"""
+        embedding = self.embedding_model.encode(text, convert_to_numpy=True, normalize_embeddings=True)
+        embedding.setflags(write=False)
+        return embedding
     
     def search(self, query, limit=5):
         """Search for similar texts"""
         
-        # Generate query embedding
-        query_embedding = self.embedding_model.encode(query).tolist()
+        # Generate query embedding (cached)
+        query_embedding = self._embed_query(query)
         
         # Search in Qdrant
         results = self.client.search(
@@ -131,6 +403,31 @@ class VectorDatabase:
         
         return results
     
+    def embed_query(self, query):
+        """Normalized query embedding (LRU-cached)"""
+        return self._embed_query(query)
+    
+    async def aembed_query(self, query):
+        """embed_query run off the event loop, since embedding is CPU-bound"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._embed_query, query)
+    
+    async def asearch(self, query, limit=5):
+        """Async variant of search, for use from the API server's event loop"""
+        
+        query_embedding = await self.aembed_query(query)
+        
+        if self._aclient is None:
+            self._aclient = AsyncQdrantClient(**self._client_kwargs)
+        
+        results = await self._aclient.search(
+            collection_name=self.collection_name,
+            query_vector=query_embedding,
+            limit=limit
+        )
+        
+        return results
+    
     def get_stats(self):
         """Get database statistics"""
         
@@ -147,6 +444,10 @@ class VectorDatabase:
     def delete_collection(self):
         """Delete the entire collection"""
         self.client.delete_collection(self.collection_name)
+        with self._fingerprint_lock:
+            self._seen_hashes.clear()
+            self._seen_simhashes = np.empty(0, dtype=np.uint64)
+            self._seen_simhash_ids = []
         print(f"🗑️  Deleted collection: {self.collection_name}")
 
 # Test the connection